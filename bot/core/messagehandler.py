@@ -1,76 +1,168 @@
 # bot.py
 import os
+import re
 import logging
 import asyncio
+from typing import Final
 from dotenv import load_dotenv
-from telegram import Update
+from telegram import LinkPreviewOptions, Message, Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     ConversationHandler, PicklePersistence,
-    ContextTypes, filters
+    ContextTypes, Defaults, filters
 )
 
+try:
+    import uvloop
+except ImportError:  # e.g. Windows
+    uvloop = None
+
 load_dotenv()
+_TOKEN = os.environ["TOKEN"]
 logging.basicConfig(
-    format="%(asctime)s - %(leveln# 1.  ⚙️ ame)s - %(message)s",
+    format="%(asctime)s - %(levelname)s - %(message)s",
     level=logging.INFO,
 )
 LOG = logging.getLogger(__name__)
 
+_POSITIVE_INT_RE = re.compile(r"[1-9][0-9]{0,5}")  # 1..999999, no sign/spaces
+_DECIMAL_RE = re.compile(r"(?:[1-9][0-9]{0,5}|0)(?:\.[0-9]{1,3})?")
+_POSITIVE_INT_ERROR: Final[str] = "⚠️ Please send a whole number from 1 to 999999."
+_NUMBER_GOAL_ERROR: Final[str] = "⚠️ Please send a whole number from 1 to {}."
+_PERCENT_GOAL_ERROR: Final[str] = (
+    "⚠️ Please send a percentage above 0 and up to 100, "
+    "with at most 3 decimal places, e.g. 5 or 2.5."
+)
+
+# Reply texts, built once at import
+START_TEXT: Final[str] = (
+    "Hello {}! 👋\n\n"
+    "I'm your personal vaping-reduction assistant.\n"
+    "Send /help for all commands."
+)
+HELP_TEXT: Final[str] = (  # MarkdownV2, already escaped
+    "*Available commands:*\n"
+    "• /start – welcome message\n"
+    "• /setup – configure your reduction plan\n"
+    "• /cancel – abort current setup\n"
+    "• /help – this help"
+)
+SUMMARY_TEXT: Final[str] = (
+    "✅ Setup complete:\n"
+    "• Puffs: {puffs}\n"
+    "• Method: {method}\n"
+    "• Goal: {goal}"
+)
+
+class SetupInProgress(filters.MessageFilter):
+    """Lets through only messages from users with a /setup in progress."""
+
+    def __init__(self, in_progress: set[int]) -> None:
+        super().__init__(name="SetupInProgress")
+        self._in_progress = in_progress
+
+    def filter(self, message: Message) -> bool:
+        user = message.from_user
+        return user is not None and user.id in self._in_progress
+
+
 class TelegramBot:
+    __slots__ = ("app", "_in_progress")
+
+    QUESTIONS: Final[tuple[tuple[str, str], ...]] = (
+        ("puffs",  "📊 How many puffs per day?"),
+        ("method", "🎯 Reduce by 'number' or 'percent'?"),
+        ("goal",   "💪 Weekly reduction goal?"),
+    )
+
     def __init__(self) -> None:
+        self._in_progress: set[int] = set()  # user ids mid-/setup
         self.app = (
             Application.builder()
-            .token(os.getenv("TOKEN"))
+            .token(_TOKEN)
+            .defaults(Defaults(
+                disable_notification=True,
+                link_preview_options=LinkPreviewOptions(is_disabled=True),
+            ))
+            .persistence(PicklePersistence(
+                filepath="conversation_states",
+                update_interval=120,  # flush half as often as the 60 s default
+            ))
+            .post_init(self._restore_in_progress)
             .build()
         )
         self._register_handlers()
-        self.QUESTIONS = [
-            ("puffs",  "📊 How many puffs per day?"),
-            ("method", "🎯 Reduce by 'number' or 'percent'?"),
-            ("goal",   "💪 Weekly reduction goal?")
-        ]
 
+    # Validators take the raw answer and the answers given so far
     @staticmethod
-    def _uid(up: Update) -> int  | None:
-        return up.effective_user.id if up.effective_user else None
+    def _validate_positive_number(text: str, answers: dict) -> tuple[bool, int | str]:
+        if not _POSITIVE_INT_RE.fullmatch(text):
+            return False, _POSITIVE_INT_ERROR
+        return True, int(text)
 
     @staticmethod
-    def _uname(up: Update) -> str | None:
-        return up.effective_user.first_name if up.effective_user else None
+    def _validate_method(text: str, answers: dict) -> tuple[bool, str]:
+        value = text.lower()
+        if value not in ("number", "percent"):
+            return False, "⚠️ Please answer 'number' or 'percent'."
+        return True, value
+
+    @staticmethod
+    def _validate_goal(text: str, answers: dict) -> tuple[bool, int | float | str]:
+        if answers["method"] == "number":
+            # Whole puffs, and no more than the daily count
+            puffs = answers["puffs"]
+            if not _POSITIVE_INT_RE.fullmatch(text) or int(text) > puffs:
+                return False, _NUMBER_GOAL_ERROR.format(puffs)
+            return True, int(text)
+        if not _DECIMAL_RE.fullmatch(text):
+            return False, _PERCENT_GOAL_ERROR
+        value = float(text) if "." in text else int(text)
+        if not 0 < value <= 100:
+            return False, _PERCENT_GOAL_ERROR
+        return True, value
+
+    # step -> (validator, answer key, next prompt or None when done)
+    _STEPS = (
+        (_validate_positive_number, QUESTIONS[0][0], QUESTIONS[1][1]),
+        (_validate_method,          QUESTIONS[1][0], QUESTIONS[2][1]),
+        (_validate_goal,            QUESTIONS[2][0], None),
+    )
     
+    async def _restore_in_progress(self, app: Application) -> None:
+        """Re-arm the setup filter for conversations restored from disk."""
+        self._in_progress.update(
+            uid for uid, data in app.user_data.items() if "step" in data
+        )
+
     def _register_handlers(self) -> None:
-        # Command handlers
+        # Single group, ordered by expected hit rate: setup answers first
         self.app.add_handlers([
+            MessageHandler(
+                filters.TEXT & ~filters.COMMAND & SetupInProgress(self._in_progress),
+                self.handle_answer
+            ),
+            CommandHandler("setup", self.start_setup),
             CommandHandler("start", self.start),
             CommandHandler("help", self.help),
-            CommandHandler("setup", self.start_setup)
         ])
-        # Message handlers
-        self.app.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            self.handle_answer
-        ))
 
     async def start(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        user = up.effective_user
         await up.message.reply_text(
-            f"Hello {self._uname(up)}! 👋\n\n"
-            "I'm your personal vaping-reduction assistant.\n"
-            "Send /help for all commands."
+            START_TEXT.format(user.first_name if user else None)
         )
 
     async def help(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
-        await up.message.reply_text(
-            "*Available commands:*\n"
-            "• /start – welcome message\n"
-            "• /setup – configure your reduction plan\n"
-            "• /cancel – abort current setup\n"
-            "• /help – this help",
-            parse_mode="MarkdownV2",
-        )
+        await up.message.reply_text(HELP_TEXT, parse_mode="MarkdownV2")
+
     async def start_setup(self, update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         """Entry point: /setup"""
+        user = update.effective_user
+        if user is None:
+            return
         ctx.user_data["step"] = 0  # Reset progress
+        self._in_progress.add(user.id)
         await self.ask_question(update, ctx)  # Send first question
     
     async def ask_question(self, update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -78,34 +170,45 @@ class TelegramBot:
         await update.message.reply_text(self.QUESTIONS[step][1])
     
     async def handle_answer(self, update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-        step = ctx.user_data.get("step")
+        ud = ctx.user_data
+        msg = update.message
+        reply = msg.reply_text
+        step = ud.get("step")
         if step is None:
             return
         
-        # 1) Store current answer
-        key = self.QUESTIONS[step][0]
-        ctx.user_data[key] = update.message.text.strip()
+        # 1) Validate and store current answer
+        validate, key, next_prompt = self._STEPS[step]
+        ok, value = validate(msg.text.strip(), ud)
+        if not ok:
+            # Send in the background; the handler returns straight away
+            ctx.application.create_task(reply(value), update=update)
+            return
+        ud[key] = value
 
         # 2) Advance or finish
-        step += 1
-        if step < len(self.QUESTIONS):
-            ctx.user_data["step"] = step
-            await self.ask_question(update, ctx)
+        if next_prompt is not None:
+            ud["step"] = step + 1
+            ctx.application.create_task(reply(next_prompt), update=update)
         else:
             await self.summary(update, ctx)
-            ctx.user_data.clear()
+            ud.clear()
+            self._in_progress.discard(msg.from_user.id)
 
     async def summary(self, update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
-            f"✅ Setup complete:\n"
-            f"• Puffs: {ctx.user_data['puffs']}\n"
-            f"• Method: {ctx.user_data['method']}\n"
-            f"• Goal: {ctx.user_data['goal']}"
-        )
+        await update.message.reply_text(SUMMARY_TEXT.format_map(ctx.user_data))
 
     def run(self) -> None:
+        if uvloop is not None:
+            # libuv-backed loop for run_polling
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         LOG.info("Bot started …")
-        self.app.run_polling()
+        # Long-poll and only receive message updates; nothing else is handled
+        self.app.run_polling(
+            timeout=50,
+            poll_interval=0.0,
+            allowed_updates=[Update.MESSAGE],
+        )
 
 
 if __name__ == "__main__":